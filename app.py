@@ -4,40 +4,74 @@ PTZ11 Broadcast Controller - FRESH START
 Minimal implementation: VISCA over UDP + RTSP stream + Web UI
 """
 
-import cv2, threading, socket, time, logging, json, os
-from flask import Flask, render_template_string, request, Response, jsonify
+import cv2, threading, socket, select, time, logging, os, queue, hashlib, gzip, collections
+import orjson
+from functools import lru_cache
+from flask import Flask, request, Response, jsonify
+from flask.json.provider import DefaultJSONProvider
+from flask_sock import Sock
 import subprocess, numpy as np
+from ptz_common import FFMPEG_BIN, FFmpegMJPEG, run_blocking, gevent_patched, exec_gunicorn
+
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _tj = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _tj = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (jsonify, request.json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
+app.json = ORJSONProvider(app)
+sockets = Sock(app)
 
 # Camera config
 CAM_IP = '192.168.1.11'
 CAM_PORT = 52381
 RTSP_URL = 'rtsp://192.168.1.11/1/h264major'
 CONFIG_FILE = 'ptz_config.json'
+PRESET_SLOTS = 16   # preset buttons shown in the UI
+FRAME_W, FRAME_H = 640, 360   # MJPEG output size, applied by the decoder where possible
+
+# FFmpeg demuxer options read by OpenCV on each open (an existing env value wins):
+# TCP transport, no input buffering/reordering, minimal stream probing
+os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS',
+                      'rtsp_transport;tcp|fflags;nobuffer|flags;low_delay|probesize;32|analyzeduration;0')
 
 # Global state
 state = {
     'pan': '03', 'tilt': '03', 'zoom': 'stop', 'focus': 'stop',
     'preset': 0, 'reachable': False, 'stream_fps': 0, 'stream_status': 'init'
 }
-lock = threading.Lock()
 seq = 0
 
+# Desired pan/tilt, zoom and focus written by handlers; the coalescer
+# thread sends only what changed, at most once per COALESCE_S
+COALESCE_S = 0.03
+desired = {}
+desired_evt = threading.Event()
+
 # Counters for FPS
 stream_frame_count = 0
-stream_last_time = time.time()
+stream_last_time = time.monotonic()
 
 def load_config():
     global CAM_IP, CAM_PORT, RTSP_URL
     if os.path.exists(CONFIG_FILE):
         try:
-            with open(CONFIG_FILE) as f:
-                cfg = json.load(f)
+            with open(CONFIG_FILE, 'rb') as f:
+                cfg = orjson.loads(f.read())
                 CAM_IP = cfg.get('cam_ip', CAM_IP)
                 CAM_PORT = cfg.get('cam_port', CAM_PORT)
                 RTSP_URL = cfg.get('rtsp_url', RTSP_URL)
@@ -47,60 +81,166 @@ def load_config():
 
 def save_config():
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump({
+        with open(CONFIG_FILE, 'wb') as f:
+            f.write(orjson.dumps({
                 'cam_ip': CAM_IP,
                 'cam_port': CAM_PORT,
                 'rtsp_url': RTSP_URL
-            }, f, indent=2)
+            }, option=orjson.OPT_INDENT_2))
     except Exception as e:
         logger.error(f"Config save error: {e}")
 
+def encode_jpeg(frame, quality=75):
+    """JPEG-encode a BGR frame, via PyTurboJPEG when available; None on failure"""
+    if _tj is not None:
+        return _tj.encode(frame, quality=quality, jpeg_subsample=TJSAMP_420)
+    ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.tobytes() if ok else None
+
+try:
+    # Taken at import, from the main thread, before any thread is pinned
+    _ALLOWED_CPUS = os.sched_getaffinity(0)
+except (AttributeError, OSError):
+    _ALLOWED_CPUS = set()
+_reader_cpu = None
+
+def pin_reader():
+    """Best effort: pin the calling video reader thread to the last allowed CPU and
+    raise its priority; needs CAP_SYS_NICE for the latter"""
+    global _reader_cpu
+    if len(_ALLOWED_CPUS) > 1:
+        try:
+            os.sched_setaffinity(0, {max(_ALLOWED_CPUS)})
+            _reader_cpu = max(_ALLOWED_CPUS)
+        except (AttributeError, OSError):
+            pass
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, -5)
+    except (AttributeError, OSError):
+        pass
+
+def pin_ffmpeg(pid):
+    """Best effort: keep the ffmpeg child (all its threads) off the reader's CPU.
+    It inherits the pinned reader's single-CPU mask, which would cap decode at one core."""
+    cpus = _ALLOWED_CPUS - {_reader_cpu} if _reader_cpu is not None else _ALLOWED_CPUS
+    if not cpus:
+        return
+    try:
+        tids = [int(t) for t in os.listdir(f'/proc/{pid}/task')]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+            os.setpriority(os.PRIO_PROCESS, tid, -5)
+        except (AttributeError, OSError):
+            pass
+
+def make_offline_jpeg():
+    """Render and encode the OFFLINE placeholder frame"""
+    frame = np.zeros((FRAME_H, FRAME_W, 3), dtype=np.uint8)
+    cv2.putText(frame, 'OFFLINE', (240, 180), 
+              cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
+    return encode_jpeg(frame)
+
+_OFFLINE_JPEG = make_offline_jpeg()
+
 def get_seq():
     global seq
     seq = (seq + 1) & 0xFFFFFFFF
     return seq
 
+@lru_cache(maxsize=512)
+def payload_bytes(payload_hex):
+    """Parse a hex command string once; joystick drags repeat the same few"""
+    return bytes.fromhex(payload_hex.replace(' ', ''))
+
+def visca_packet_from_bytes(payload):
+    """Wrap raw payload bytes in the VISCA-over-IP header and FF terminator"""
+    s = get_seq()
+    return b'\x01\x00\x00' + bytes(((len(payload) + 1) & 0xFF,)) + s.to_bytes(4, 'big') + payload + b'\xFF'
+
 def visca_packet(payload_hex):
-    """Create VISCA UDP packet"""
+    """Create VISCA UDP packet from a hex command string"""
     try:
-        payload = bytearray.fromhex(payload_hex.replace(' ', '').upper())
-        s = get_seq()
-        length = len(payload) + 1
-        header = bytearray([0x01, 0x00, 0x00, length & 0xFF])
-        header.extend(s.to_bytes(4, 'big'))
-        return header + payload + b'\xFF'
+        return visca_packet_from_bytes(payload_bytes(payload_hex))
     except Exception as e:
         logger.error(f"Packet error: {e}")
         return None
 
-def send_cmd(payload_hex):
-    """Send VISCA command to camera"""
-    with lock:
+# VISCA sender: one thread owns sending on a persistent non-blocking UDP socket;
+# handlers only enqueue and a reader thread drains camera replies. There are no
+# per-subsystem locks: pan/tilt, zoom, focus and preset commands share one FIFO
+# that never waits on replies, so a preset call during a drag delays the next
+# pan/tilt by a single sendto.
+_visca_q = queue.SimpleQueue()
+_visca_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+_visca_sock.setblocking(False)
+_SEND_FLAGS = getattr(socket, 'MSG_DONTWAIT', 0)
+_pending = {}   # seq -> waiter dict of send_cmd_sync callers
+
+def visca_worker():
+    """Build and send queued VISCA commands in order"""
+    while True:
+        payload, waiter = _visca_q.get()
         try:
-            pkt = visca_packet(payload_hex)
+            if isinstance(payload, bytes):
+                pkt = visca_packet_from_bytes(payload)
+            else:
+                pkt = visca_packet(payload)
             if not pkt:
-                return False
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(0.5)
-            sock.sendto(pkt, (CAM_IP, CAM_PORT))
-            try:
-                sock.recvfrom(1024)
-            except:
-                pass
-            sock.close()
-            return True
+                continue
+            if waiter is not None:
+                # Register before sending so a fast reply can't be missed
+                waiter['seq'] = int.from_bytes(pkt[4:8], 'big')
+                _pending[waiter['seq']] = waiter
+            _visca_sock.sendto(pkt, _SEND_FLAGS, (CAM_IP, CAM_PORT))
         except Exception as e:
             logger.error(f"Send error: {e}")
-            return False
 
-def pan_tilt(pan_byte, tilt_byte, speed=10):
-    """Send pan/tilt command"""
+def visca_ack_reader():
+    """Drain ACK/completion replies; wake any send_cmd_sync waiting on that seq"""
+    while True:
+        r, _, _ = select.select([_visca_sock], [], [], 0.5)
+        if not r:
+            continue
+        try:
+            # Replies stay out of state: the seq bytes would change the
+            # /api/status ETag and the SSE frame on every ACK of a drag
+            data, _ = _visca_sock.recvfrom(1024)
+            if len(data) >= 8:
+                waiter = _pending.pop(int.from_bytes(data[4:8], 'big'), None)
+                if waiter is not None:
+                    waiter['reply'] = data
+                    waiter['evt'].set()
+        except OSError:
+            pass
+
+def send_cmd(payload):
+    """Queue VISCA command (payload bytes or hex string); fire-and-forget"""
+    _visca_q.put((payload, None))
+    return True
+
+def send_cmd_sync(payload, timeout=0.5):
+    """Queue VISCA command and wait for the camera's reply; False on error or timeout"""
+    waiter = {'evt': threading.Event(), 'seq': None, 'reply': None}
+    _visca_q.put((payload, waiter))
+    if not waiter['evt'].wait(timeout):
+        _pending.pop(waiter['seq'], None)
+        return False
+    reply = waiter['reply']
+    # 90 4y = ACK, 90 5y = completion, 90 6y = error
+    return len(reply) > 9 and (reply[9] & 0xF0) != 0x60
+
+threading.Thread(target=visca_worker, daemon=True).start()
+threading.Thread(target=visca_ack_reader, daemon=True).start()
+
+def pan_tilt(pan, tilt, speed=10):
+    """Send pan/tilt command (pan/tilt are direction bytes 0x01-0x03)"""
     speed = max(1, min(24, speed))
-    cmd = f"81 01 06 01 {speed:02X} {speed:02X} {pan_byte} {tilt_byte}"
-    send_cmd(cmd)
-    state['pan'] = pan_byte
-    state['tilt'] = tilt_byte
+    send_cmd(bytes((0x81, 0x01, 0x06, 0x01, speed, speed, pan, tilt)))
+    state['pan'] = f"{pan:02X}"
+    state['tilt'] = f"{tilt:02X}"
 
 def zoom(direction, speed=1):
     """Zoom in/out"""
@@ -111,7 +251,7 @@ def zoom(direction, speed=1):
         byte = 0x30 + speed
     else:
         byte = 0x00
-    send_cmd(f"81 01 04 07 {byte:02X}")
+    send_cmd(bytes((0x81, 0x01, 0x04, 0x07, byte)))
     state['zoom'] = direction
 
 def focus(direction, speed=1):
@@ -123,12 +263,39 @@ def focus(direction, speed=1):
         byte = 0x30 + speed
     else:
         byte = 0x00
-    send_cmd(f"81 01 04 08 {byte:02X}")
+    send_cmd(bytes((0x81, 0x01, 0x04, 0x08, byte)))
     state['focus'] = direction
 
+def set_desired(kind, value):
+    """Record the latest wanted motion for kind and wake the coalescer"""
+    desired[kind] = value
+    desired_evt.set()
+
+def coalescer_loop():
+    """Collapse bursts of motion requests into one VISCA send per change"""
+    apply = {
+        'pan': lambda v: pan_tilt(*v),
+        'zoom': lambda v: zoom(*v),
+        'focus': lambda v: focus(*v),
+    }
+    sent = {}
+    while True:
+        desired_evt.wait()
+        desired_evt.clear()
+        for kind, value in list(desired.items()):
+            if sent.get(kind) != value:
+                try:
+                    apply[kind](value)
+                except Exception as e:
+                    logger.error(f"Coalesced {kind} error: {e}")
+                sent[kind] = value
+        time.sleep(COALESCE_S)
+
+threading.Thread(target=coalescer_loop, daemon=True).start()
+
 def stop_movement():
     """Stop all movement"""
-    pan_tilt('03', '03', 0)
+    pan_tilt(0x03, 0x03, 0)
     zoom('stop', 0)
     focus('stop', 0)
 
@@ -139,46 +306,154 @@ def preset_call(num):
         state['preset'] = num
 
 def preset_set(num):
-    """Save preset"""
+    """Save preset, waiting for the camera to acknowledge it"""
     if 1 <= num <= 255:
-        send_cmd(f"81 01 04 3F 00 {num:02X}")
-        state['preset'] = num
+        ok = send_cmd_sync(f"81 01 04 3F 01 {num:02X}")
+        if ok:
+            state['preset'] = num
+        return ok
+    return False
+
+def preset_delete(num):
+    """Clear preset (CAM_Memory Reset), waiting for the camera to acknowledge it"""
+    if 1 <= num <= 255:
+        return send_cmd_sync(f"81 01 04 3F 00 {num:02X}")
+    return False
+
+# VISCA-over-IP inquiry (payload type 0x0110) for CAM_ZoomPosInq 81 09 04 47 FF.
+# Any reply proves the VISCA service itself is up, not just the IP route.
+_PROBE_PKT = b'\x01\x10\x00\x05\x00\x00\x00\x00\x81\x09\x04\x47\xFF'
 
 def check_camera():
-    """Check if camera is reachable"""
+    """Check if camera answers a VISCA inquiry"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        result = subprocess.run(
-            ['ping', '-c', '1', '-W', '1', CAM_IP],
-            capture_output=True, timeout=2
-        )
-        state['reachable'] = (result.returncode == 0)
-    except:
+        sock.settimeout(0.5)
+        sock.sendto(_PROBE_PKT, (CAM_IP, CAM_PORT))
+        sock.recvfrom(64)
+        state['reachable'] = True
+    except OSError:
         state['reachable'] = False
+    finally:
+        sock.close()
 
-def gen_frames():
-    """Generate video frames"""
-    global stream_frame_count, stream_last_time
+# Shared MJPEG frame slot: the capture thread overwrites it, viewers wait for a newer one
+frame_cv = threading.Condition()
+latest_frame = (0, None)   # (frame id, multipart part: header + jpeg + trailer)
+viewers = 0
+_MJPEG_HDR = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+_MJPEG_TRL = b'\r\n'
+capture_thread = None
+capture_lock = threading.Lock()
+
+# Shared fMP4 remux for /video.mp4: one ffmpeg (one RTSP session) for all viewers.
+# The init segment (ftyp+moov) is cached for late joiners; moof+mdat fragments go
+# into a short ring that each viewer reads from by fragment id
+MP4_BACKLOG = 64
+mp4_cv = threading.Condition()
+mp4_init = None    # ftyp + moov of the running remux, None until ffmpeg writes it
+mp4_codec = None   # MSE codec string from the avcC box, e.g. 'avc1.64001f'
+mp4_gen = 0        # bumped whenever the remux stops: viewers' timelines end with it
+mp4_frags = collections.deque(maxlen=MP4_BACKLOG)   # (id, starts with IDR, moof+mdat)
+mp4_next_id = 0
+mp4_viewers = 0
+remux_thread = None
+
+def has_gstreamer():
+    """True if this OpenCV build includes the GStreamer backend"""
+    for line in cv2.getBuildInformation().splitlines():
+        if 'GStreamer' in line:
+            return 'YES' in line
+    return False
+
+GST_AVAILABLE = has_gstreamer()
+
+def gst_pipeline():
+    """RTSP -> decode -> FRAME_W x FRAME_H -> JPEG, delivered encoded through appsink"""
+    return (f'rtspsrc location={RTSP_URL} latency=0 protocols=tcp ! rtph264depay ! h264parse ! '
+            f'decodebin ! videoconvert ! videoscale ! video/x-raw,width={FRAME_W},height={FRAME_H} ! '
+            'jpegenc quality=75 ! appsink drop=true max-buffers=1 sync=false')
+
+def open_capture():
+    """Open RTSP; returns (cap, jpeg_ready) where jpeg_ready means frames are already JPEG"""
+    if FFMPEG_BIN:
+        logger.info("RTSP via ffmpeg MJPEG pipe (no Python-side decode/encode)")
+        cap = FFmpegMJPEG(RTSP_URL, (FRAME_W, FRAME_H), quality=5)
+        pin_ffmpeg(cap.proc.pid)
+        return cap, True
+    
+    if GST_AVAILABLE:
+        cap = run_blocking(cv2.VideoCapture, gst_pipeline(), cv2.CAP_GSTREAMER)
+        if cap.isOpened():
+            logger.info("RTSP via GStreamer appsink (JPEG passthrough)")
+            return cap, True
+        logger.warning("GStreamer pipeline failed, falling back to FFmpeg")
+    
+    # FFmpeg backend, asking for hardware decode when OpenCV supports it.
+    # Short open/read timeouts so a dead stream is recycled quickly.
+    params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 2000, cv2.CAP_PROP_READ_TIMEOUT_MSEC, 1000]
+    hw = []
+    if hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+        hw = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    cap = run_blocking(cv2.VideoCapture, RTSP_URL, cv2.CAP_FFMPEG, hw + params)
+    if hw and not cap.isOpened():
+        logger.warning("HW decode open failed, retrying in software")
+        cap = run_blocking(cv2.VideoCapture, RTSP_URL, cv2.CAP_FFMPEG, params)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    cap.set(cv2.CAP_PROP_FPS, 30)
+    # Ask for the output size at the source; ignored by backends that can't scale
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_W)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_H)
+    if hw and cap.isOpened():
+        logger.info(f"RTSP decode acceleration: {int(cap.get(cv2.CAP_PROP_HW_ACCELERATION))}")
+    return cap, False
+
+def capture_loop():
+    """Read RTSP once and publish each encoded frame to the shared slot"""
+    global stream_frame_count, stream_last_time, latest_frame
     cap = None
+    jpeg_ready = False
     error_count = 0
     
+    # Under gevent this is the hub thread, which must not be pinned
+    if not gevent_patched():
+        pin_reader()
+    
     while True:
         try:
-            if cap is None or not cap.isOpened():
+            if not viewers:
+                if cap is not None:
+                    logger.info("No viewers, closing RTSP")
+                    cap.release()
+                    cap = None
+                time.sleep(0.1)
+                continue
+            
+            if cap is None:
                 logger.info(f"Opening RTSP: {RTSP_URL}")
-                cap = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
-                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                cap.set(cv2.CAP_PROP_FPS, 30)
-                error_count = 0
+                cap, jpeg_ready = open_capture()
             
-            ret, frame = cap.read()
+            if not cap.isOpened():
+                ret, frame = False, None
+            elif isinstance(cap, FFmpegMJPEG):
+                ret, frame = cap.read()
+            else:
+                ret, frame = run_blocking(cap.read)
             
             if not ret:
                 error_count += 1
-                if error_count > 15:
-                    frame = np.zeros((360, 640, 3), dtype=np.uint8)
-                    cv2.putText(frame, 'OFFLINE', (240, 180), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
+                dead = not cap.isOpened()
+                if dead or error_count > 15:
+                    # Dead stream: reuse the pre-encoded placeholder
                     state['stream_status'] = 'offline'
+                    jpg = _OFFLINE_JPEG
+                    if dead:
+                        # ffmpeg exited / open failed: back off before respawning
+                        cap.release()
+                        cap = None
+                        time.sleep(1)
+                    else:
+                        time.sleep(0.1)
                 else:
                     state['stream_status'] = 'buffering'
                     time.sleep(0.1)
@@ -187,79 +462,417 @@ def gen_frames():
                 error_count = 0
                 state['stream_status'] = 'live'
                 stream_frame_count += 1
-                now = time.time()
+                now = time.monotonic()
                 if now - stream_last_time >= 1.0:
                     state['stream_fps'] = stream_frame_count
                     stream_frame_count = 0
                     stream_last_time = now
+                
+                if jpeg_ready:
+                    # ffmpeg/appsink already delivered the encoded JPEG
+                    jpg = bytes(frame)
+                else:
+                    h, w = frame.shape[:2]
+                    if (w, h) != (FRAME_W, FRAME_H):
+                        # INTER_AREA averages properly on downscale; LINEAR for upscale
+                        interp = cv2.INTER_AREA if w > FRAME_W else cv2.INTER_LINEAR
+                        frame = cv2.resize(frame, (FRAME_W, FRAME_H), interpolation=interp)
+                    jpg = run_blocking(encode_jpeg, frame)
+                    if jpg is None:
+                        continue
             
-            frame = cv2.resize(frame, (640, 360))
-            ret, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 75])
-            if ret:
-                yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buf.tobytes() + b'\r\n'
+            # Frame once as a complete multipart part, shared by every viewer.
+            # Drop-on-latency: older unsent frames are simply overwritten
+            part = _MJPEG_HDR + jpg + _MJPEG_TRL
+            with frame_cv:
+                latest_frame = (latest_frame[0] + 1, part)
+                frame_cv.notify_all()
         
         except Exception as e:
             logger.error(f"Stream error: {e}")
             time.sleep(1)
 
+def start_capture():
+    """Start the shared capture thread on first use"""
+    global capture_thread
+    with capture_lock:
+        if capture_thread is None:
+            capture_thread = threading.Thread(target=capture_loop, daemon=True)
+            capture_thread.start()
+
+def gen_frames():
+    """Generate video frames for one viewer"""
+    global viewers
+    start_capture()
+    with frame_cv:
+        viewers += 1
+    last_id = None
+    try:
+        while True:
+            with frame_cv:
+                if not frame_cv.wait_for(lambda: latest_frame[0] != last_id and latest_frame[1], timeout=5):
+                    continue
+                last_id, part = latest_frame
+            # One yield per frame: servers write (and chunk) each yielded item separately
+            yield part
+    finally:
+        with frame_cv:
+            viewers -= 1
+
+def read_exact(f, n):
+    """n bytes from a pipe, or None at EOF"""
+    buf = b''
+    while len(buf) < n:
+        chunk = f.read(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+def read_box(f):
+    """Next top-level MP4 box (header included), or None at EOF"""
+    hdr = read_exact(f, 8)
+    if hdr is None:
+        return None
+    size = int.from_bytes(hdr[:4], 'big')
+    if size == 1:
+        ext = read_exact(f, 8)
+        if ext is None:
+            return None
+        hdr += ext
+        size = int.from_bytes(ext, 'big')
+    if size < len(hdr):
+        return None
+    body = read_exact(f, size - len(hdr))
+    return None if body is None else hdr + body
+
+def avc_codec(moov):
+    """(MSE codec string, NAL length size) from the moov's avcC box; (None, 4) if not H.264"""
+    i = moov.find(b'avcC')
+    if i < 0 or len(moov) < i + 9:
+        return None, 4
+    # configurationVersion, AVCProfileIndication, profile_compatibility, AVCLevelIndication, lengthSizeMinusOne
+    c = moov[i + 4:i + 9]
+    return f"avc1.{c[1]:02x}{c[2]:02x}{c[3]:02x}", (c[4] & 3) + 1
+
+def has_idr(mdat, nal_len):
+    """True if the mdat's length-prefixed NAL units include an IDR slice (type 5)"""
+    pos = 16 if int.from_bytes(mdat[:4], 'big') == 1 else 8
+    while pos + nal_len < len(mdat):
+        if mdat[pos + nal_len] & 0x1F == 5:
+            return True
+        pos += nal_len + int.from_bytes(mdat[pos:pos + nal_len], 'big')
+    return False
+
+def remux_once():
+    """Run one ffmpeg remux and publish its boxes until it exits or the last viewer leaves"""
+    global mp4_init, mp4_codec, mp4_next_id
+    logger.info(f"Opening RTSP for fMP4: {RTSP_URL}")
+    proc = subprocess.Popen(
+        [FFMPEG_BIN, '-nostdin', '-loglevel', 'error',
+         '-fflags', 'nobuffer', '-flags', 'low_delay', '-rtsp_transport', 'tcp',
+         '-i', RTSP_URL, '-an', '-c:v', 'copy',
+         # A fragment per frame: frag_keyframe alone would hold every fragment for a full GOP
+         '-f', 'mp4', '-movflags', 'frag_every_frame+empty_moov+default_base_moof',
+         '-flush_packets', '1', 'pipe:1'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+    )
+    init = b''
+    moof = None
+    nal_len = 4
+    try:
+        while mp4_viewers:
+            box = read_box(proc.stdout)
+            if box is None:
+                logger.warning("fMP4 remux ended")
+                return
+            kind = box[4:8]
+            if kind in (b'ftyp', b'moov'):
+                init += box
+                if kind == b'moov':
+                    codec, nal_len = avc_codec(box)
+                    if codec is None:
+                        logger.warning("RTSP stream is not H.264, /video.mp4 unavailable")
+                    with mp4_cv:
+                        mp4_init, mp4_codec = init, codec
+                        mp4_cv.notify_all()
+            elif kind == b'moof':
+                moof = box
+            elif kind == b'mdat' and moof is not None:
+                with mp4_cv:
+                    mp4_next_id += 1
+                    mp4_frags.append((mp4_next_id, has_idr(box, nal_len), moof + box))
+                    mp4_cv.notify_all()
+                moof = None
+        logger.info("No fMP4 viewers, closing RTSP")
+    finally:
+        proc.kill()
+        proc.wait()
+
+def remux_loop():
+    """Keep one shared remux running while /video.mp4 has viewers"""
+    global mp4_init, mp4_codec, mp4_gen
+    while True:
+        with mp4_cv:
+            mp4_cv.wait_for(lambda: mp4_viewers > 0)
+        try:
+            remux_once()
+        except Exception as e:
+            logger.error(f"fMP4 remux error: {e}")
+        with mp4_cv:
+            mp4_init = mp4_codec = None
+            mp4_gen += 1
+            mp4_frags.clear()
+            mp4_cv.notify_all()
+            respawn = mp4_viewers > 0
+        if respawn:
+            # ffmpeg exited with viewers waiting: back off before respawning
+            time.sleep(1)
+
+def start_remux():
+    """Start the shared remux thread on first use"""
+    global remux_thread
+    with capture_lock:
+        if remux_thread is None:
+            remux_thread = threading.Thread(target=remux_loop, daemon=True)
+            remux_thread.start()
+
+def leave_mp4():
+    global mp4_viewers
+    with mp4_cv:
+        mp4_viewers -= 1
+
+def gen_mp4(gen, init, last):
+    """Init segment, then every fragment after id last, starting at an IDR"""
+    yield init
+    need_key = True
+    while True:
+        with mp4_cv:
+            if not mp4_cv.wait_for(lambda: mp4_gen != gen or mp4_next_id != last, timeout=5):
+                continue
+            if mp4_gen != gen:
+                # Remux restarted: its init segment and timeline don't continue this one
+                return
+            frags = [f for f in mp4_frags if f[0] > last]
+        if frags[0][0] != last + 1:
+            # Fell behind the backlog: skip to the next IDR
+            need_key = True
+        out = []
+        for fid, key, data in frags:
+            last = fid
+            if need_key and not key:
+                continue
+            need_key = False
+            out.append(data)
+        if out:
+            yield b''.join(out)
+
 # ROUTES
 @app.route('/')
 def index():
-    return render_template_string(HTML)
+    # Static page: serve pre-encoded (and pre-gzipped) bytes, 304 on matching If-None-Match
+    # q-value, not membership: 'gzip;q=0' means the client refuses gzip
+    gz = request.accept_encodings['gzip'] > 0
+    resp = Response(_INDEX_GZIP if gz else _INDEX_BYTES, mimetype='text/html')
+    if gz:
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.set_etag(_INDEX_ETAG + ('-gz' if gz else ''))
+    resp.headers['Cache-Control'] = 'public, max-age=300'
+    return resp.make_conditional(request)
 
 @app.route('/video')
 def video():
     return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/video.mp4')
+def video_mp4():
+    """Camera H.264 remuxed (not decoded) to fragmented MP4 for browser MSE playback;
+    X-Video-Codec carries the codec string read from the stream"""
+    global mp4_viewers
+    if not FFMPEG_BIN:
+        return 'ffmpeg not installed', 503
+    start_remux()
+    with mp4_cv:
+        mp4_viewers += 1
+        mp4_cv.notify_all()
+        # Late joiners get the cached init segment of the running remux
+        if not mp4_cv.wait_for(lambda: mp4_init is not None, timeout=10) or not mp4_codec:
+            mp4_viewers -= 1
+            return 'H.264 stream unavailable', 503
+        gen, init, codec, last = mp4_gen, mp4_init, mp4_codec, mp4_next_id
+    resp = Response(gen_mp4(gen, init, last), mimetype='video/mp4',
+                    headers={'Cache-Control': 'no-cache', 'X-Video-Codec': codec})
+    # Runs even if the client goes away before the generator starts
+    resp.call_on_close(leave_mp4)
+    return resp
+
+# Control ops shared by the HTTP routes and the /ws channel; args is any
+# mapping with .get (request.args or a decoded WebSocket message). Bad
+# arguments raise ValueError: 400 over HTTP, logged and skipped over /ws
+_DIRS = {'01': 0x01, '02': 0x02, '03': 0x03}   # VISCA pan/tilt direction bytes
+
+def arg_dir(args, key):
+    v = args.get(key, '03')
+    if not isinstance(v, str) or v.upper() not in _DIRS:
+        raise ValueError(f"bad {key}: {v!r}")
+    return _DIRS[v.upper()]
+
+def arg_int(args, key, default):
+    v = args.get(key, default)
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"bad {key}: {v!r}") from None
+
+def arg_choice(args, key, choices):
+    v = args.get(key, 'stop')
+    if v not in choices:
+        raise ValueError(f"bad {key}: {v!r}")
+    return v
+
+def op_move(args):
+    # Parse the hex direction bytes once here; pan_tilt builds bytes directly
+    p = arg_dir(args, 'p')
+    t = arg_dir(args, 't')
+    s = arg_int(args, 's', '10')
+    logger.info(f"MOVE p={p:02X} t={t:02X} s={s}")
+    set_desired('pan', (p, t, s))
+
+def op_stop(args):
+    logger.info("STOP")
+    # Send stop now; updating desired also corrects any move already in flight
+    set_desired('pan', (0x03, 0x03, 0))
+    set_desired('zoom', ('stop', 0))
+    set_desired('focus', ('stop', 0))
+    stop_movement()
+
+def op_zoom(args):
+    d = arg_choice(args, 'dir', ('in', 'out', 'stop'))
+    s = arg_int(args, 's', '1')
+    logger.info(f"ZOOM {d} {s}")
+    set_desired('zoom', (d, s))
+
+def op_focus(args):
+    d = arg_choice(args, 'dir', ('near', 'far', 'stop'))
+    s = arg_int(args, 's', '1')
+    logger.info(f"FOCUS {d} {s}")
+    set_desired('focus', (d, s))
+
+def op_preset_call(args):
+    num = arg_int(args, 'num', 1)
+    logger.info(f"PRESET CALL {num}")
+    preset_call(num)
+
+OPS = {
+    'move': op_move,
+    'stop': op_stop,
+    'zoom': op_zoom,
+    'focus': op_focus,
+    'preset_call': op_preset_call,
+}
+
+@sockets.route('/ws')
+def ws(sock):
+    """Control channel: one JSON message {"op": ..., ...} per command"""
+    while True:
+        raw = sock.receive()
+        try:
+            msg = orjson.loads(raw)
+            if not isinstance(msg, dict):
+                raise ValueError('not a JSON object')
+            op = OPS.get(msg.get('op'))
+        except (ValueError, TypeError) as e:
+            # orjson.JSONDecodeError is a ValueError; a bad message must not end the channel
+            logger.warning(f"Bad ws message {str(raw)[:80]!r}: {e}")
+            continue
+        if op is None:
+            logger.warning(f"Unknown ws op: {msg.get('op')}")
+            continue
+        try:
+            op(msg)
+        except ValueError as e:
+            logger.warning(f"Bad ws {msg.get('op')} args: {e}")
+        except Exception as e:
+            logger.error(f"ws {msg.get('op')} error: {e}")
+
+def http_op(name, ok_body='OK'):
+    """Run a control op on the query string; 400 on bad arguments"""
+    try:
+        OPS[name](request.args)
+    except ValueError as e:
+        return str(e), 400
+    return ok_body
+
 @app.route('/api/move')
 def api_move():
-    p = request.args.get('p', '03')
-    t = request.args.get('t', '03')
-    s = int(request.args.get('s', '10'))
-    logger.info(f"MOVE p={p} t={t} s={s}")
-    pan_tilt(p, t, s)
-    return 'OK'
+    return http_op('move')
 
 @app.route('/api/stop')
 def api_stop():
-    logger.info("STOP")
-    stop_movement()
-    return 'OK'
+    return http_op('stop')
 
 @app.route('/api/zoom')
 def api_zoom():
-    d = request.args.get('dir', 'stop')
-    s = int(request.args.get('s', '1'))
-    logger.info(f"ZOOM {d} {s}")
-    zoom(d, s)
-    return 'OK'
+    return http_op('zoom')
 
 @app.route('/api/focus')
 def api_focus():
-    d = request.args.get('dir', 'stop')
-    s = int(request.args.get('s', '1'))
-    logger.info(f"FOCUS {d} {s}")
-    focus(d, s)
-    return 'OK'
+    return http_op('focus')
 
 @app.route('/api/preset/call')
 def api_preset_call():
-    num = int(request.args.get('num', 1))
-    logger.info(f"PRESET CALL {num}")
-    preset_call(num)
-    return jsonify({'ok': True})
+    return http_op('preset_call', {'ok': True})
 
 @app.route('/api/preset/set')
 def api_preset_set():
-    num = int(request.args.get('num', 1))
+    try:
+        num = arg_int(request.args, 'num', 1)
+    except ValueError as e:
+        return str(e), 400
     logger.info(f"PRESET SET {num}")
-    preset_set(num)
-    return jsonify({'ok': True})
+    return jsonify({'ok': preset_set(num)})
+
+@app.route('/api/preset/delete_all')
+def api_preset_delete_all():
+    logger.info(f"PRESET DELETE ALL (1-{PRESET_SLOTS})")
+    # Stop at the first unacknowledged reset: a dead camera costs one timeout, not sixteen
+    ok = all(preset_delete(i) for i in range(1, PRESET_SLOTS + 1))
+    return jsonify({'ok': ok})
 
 @app.route('/api/status')
 def api_status():
     return jsonify(state)
 
+@app.after_request
+def status_etag(resp):
+    # Unchanged status polls get 304 with no body
+    if request.path == '/api/status' and resp.status_code == 200:
+        resp.add_etag()
+        return resp.make_conditional(request)
+    return resp
+
+@app.route('/api/events')
+@app.route('/api/status/stream')
+def api_events():
+    """Server-sent events: push state on change, heartbeat comment otherwise"""
+    def events():
+        last = None
+        idle = 0
+        while True:
+            cur = orjson.dumps(state)
+            if cur != last:
+                yield b'data: ' + cur + b'\n\n'
+                last = cur
+                idle = 0
+            else:
+                idle += 1
+                if idle >= 30:
+                    yield b': ping\n\n'
+                    idle = 0
+            time.sleep(0.5)
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/api/config', methods=['GET', 'POST'])
 def api_config():
     global CAM_IP, CAM_PORT, RTSP_URL
@@ -293,14 +906,14 @@ body { width: 100%; height: 100vh; background: var(--bg); color: var(--text); fo
 .header h1 { font-size: 16px; color: var(--primary); }
 .content { display: flex; flex: 1; gap: 10px; padding: 10px; }
 .video { flex: 1; background: #000; border: 2px solid var(--border); position: relative; }
-.video img { width: 100%; height: 100%; object-fit: contain; }
+.video img, .video video { width: 100%; height: 100%; object-fit: contain; }
 .video-info { position: absolute; top: 8px; right: 8px; background: rgba(0,0,0,0.7); padding: 5px 10px; border-radius: 3px; font-size: 11px; }
 .panel { width: 300px; background: #2d2d2d; border: 2px solid var(--border); display: flex; flex-direction: column; overflow: hidden; }
 .panel-title { background: #1a1a1a; padding: 10px; font-weight: bold; font-size: 12px; border-bottom: 2px solid var(--border); color: var(--primary); }
 .panel-body { flex: 1; overflow-y: auto; padding: 12px; display: flex; flex-direction: column; gap: 12px; }
 .control-section { display: flex; flex-direction: column; gap: 8px; }
 .control-label { font-size: 11px; font-weight: bold; text-transform: uppercase; color: var(--primary); }
-.joystick { width: 150px; height: 150px; background: radial-gradient(circle at 35% 35%, #3d3d3d, #1a1a1a); border: 2px solid var(--border); border-radius: 50%; position: relative; cursor: crosshair; display: flex; align-items: center; justify-content: center; margin: 0 auto; }
+.joystick { width: 150px; height: 150px; background: radial-gradient(circle at 35% 35%, #3d3d3d, #1a1a1a); border: 2px solid var(--border); border-radius: 50%; position: relative; cursor: crosshair; touch-action: none; display: flex; align-items: center; justify-content: center; margin: 0 auto; }
 .joystick-knob { width: 40px; height: 40px; background: radial-gradient(circle at 30% 30%, #666, #222); border: 2px solid var(--border); border-radius: 50%; position: absolute; cursor: grab; }
 .joystick-knob.active { cursor: grabbing; }
 .slider { width: 100%; height: 5px; background: linear-gradient(90deg, #ff6b00, var(--primary), #ffb700); border-radius: 3px; cursor: pointer; }
@@ -373,6 +986,7 @@ body { width: 100%; height: 100vh; background: var(--bg); color: var(--text); fo
 <div class="control-section">
 <div class="control-label">Presets</div>
 <div class="presets" id="presets"></div>
+<button class="btn" id="clear-btn">CLEAR ALL</button>
 </div>
 </div>
 </div>
@@ -397,17 +1011,40 @@ let joyPointerId = null;
 let lastCmd = null;
 let speedMult = 0.5;
 
-// Joystick
-joypad.addEventListener('pointerdown', (e) => {
-    joyActive = true;
-    joyPointerId = e.pointerId;
-    joyKnob.classList.add('active');
-    joypad.setPointerCapture(e.pointerId);
-});
+// 8-way pan/tilt bytes keyed by "sign(x),sign(y)" outside the dead zone
+const JOY_DEADZONE = 10;
+const DIR_TABLE = {
+    '-1,-1': { p: '01', t: '01' }, '0,-1': { p: '03', t: '01' }, '1,-1': { p: '02', t: '01' },
+    '-1,0':  { p: '01', t: '03' }, '0,0':  { p: '03', t: '03' }, '1,0':  { p: '02', t: '03' },
+    '-1,1':  { p: '01', t: '02' }, '0,1':  { p: '03', t: '02' }, '1,1':  { p: '02', t: '02' }
+};
 
-document.addEventListener('pointermove', (e) => {
-    if (!joyActive || e.pointerId !== joyPointerId) return;
-    
+function getJoyDirection(x, y, dist, maxDist) {
+    const sx = x < -JOY_DEADZONE ? -1 : x > JOY_DEADZONE ? 1 : 0;
+    const sy = y < -JOY_DEADZONE ? -1 : y > JOY_DEADZONE ? 1 : 0;
+    const speed = Math.max(1, Math.min(24, Math.floor((dist / maxDist) * 24 * speedMult)));
+    return { ...DIR_TABLE[sx + ',' + sy], s: speed };
+}
+
+// Control channel: WebSocket when open, plain HTTP GET otherwise
+let ctlSock = null;
+
+function connectCtl() {
+    const proto = location.protocol === 'https:' ? 'wss' : 'ws';
+    ctlSock = new WebSocket(`${proto}://${location.host}/ws`);
+    ctlSock.onclose = () => { ctlSock = null; setTimeout(connectCtl, 2000); };
+}
+
+function sendCtl(msg, url, label) {
+    if (ctlSock && ctlSock.readyState === WebSocket.OPEN) {
+        ctlSock.send(JSON.stringify(msg));
+    } else {
+        fetch(url).catch(e => console.error(`${label} error:`, e));
+    }
+}
+
+// Joystick: pointer capture routes move/up to the pad only while dragging
+function handleJoyMove(e) {
     const rect = joypad.getBoundingClientRect();
     const cx = rect.width / 2;
     const cy = rect.height / 2;
@@ -418,53 +1055,66 @@ document.addEventListener('pointermove', (e) => {
     const maxDist = 60;
     
     if (dist > maxDist) {
-        const angle = Math.atan2(y, x);
-        x = Math.cos(angle) * maxDist;
-        y = Math.sin(angle) * maxDist;
+        x = x * maxDist / dist;
+        y = y * maxDist / dist;
     }
     
     joyKnob.style.transform = `translate(calc(-50% + ${x}px), calc(-50% + ${y}px))`;
     
-    // Calculate direction
-    const angle = Math.atan2(y, x) * (180 / Math.PI);
-    const speed = Math.max(1, Math.min(24, Math.floor((dist / maxDist) * 24 * speedMult)));
-    
-    let p = '03', t = '03';
-    if (angle > -45 && angle <= 45) { p = '02'; t = (angle > 0) ? '02' : (angle < 0) ? '01' : '03'; }
-    else if (angle > 45 && angle <= 135) { t = '02'; p = (angle < 90) ? '02' : '01'; }
-    else if (angle > 135 || angle <= -135) { p = '01'; t = (angle > 0) ? '02' : '01'; }
-    else if (angle > -135 && angle <= -45) { t = '01'; p = (angle > -90) ? '02' : '01'; }
+    const { p, t, s: speed } = getJoyDirection(x, y, dist, maxDist);
     
     const url = `/api/move?p=${p}&t=${t}&s=${speed}`;
     if (url !== lastCmd) {
-        fetch(url).catch(e => console.error('Move error:', e));
+        sendCtl({ op: 'move', p, t, s: speed }, url, 'Move');
         lastCmd = url;
     }
-});
+}
 
-document.addEventListener('pointerup', (e) => {
+function endJoy(e) {
     if (!joyActive || e.pointerId !== joyPointerId) return;
+    if (joypad.hasPointerCapture(e.pointerId)) joypad.releasePointerCapture(e.pointerId);
     joyActive = false;
     joyPointerId = null;
     joyKnob.classList.remove('active');
     joyKnob.style.transform = 'translate(-50%, -50%)';
-    fetch('/api/stop').catch(e => console.error('Stop error:', e));
+    sendCtl({ op: 'stop' }, '/api/stop', 'Stop');
     lastCmd = null;
+}
+
+joypad.addEventListener('pointerdown', (e) => {
+    joyActive = true;
+    joyPointerId = e.pointerId;
+    joyKnob.classList.add('active');
+    joypad.setPointerCapture(e.pointerId);
+    handleJoyMove(e);
 });
 
+joypad.addEventListener('pointermove', (e) => {
+    if (joyActive && e.pointerId === joyPointerId) handleJoyMove(e);
+});
+
+joypad.addEventListener('pointerup', endJoy);
+joypad.addEventListener('pointercancel', endJoy);
+
 joySpeed.addEventListener('input', (e) => {
     speedMult = parseInt(e.target.value) / 24;
     document.getElementById('speed-label').textContent = `Speed: ${e.target.value}`;
 });
 
 stopBtn.addEventListener('click', () => {
-    fetch('/api/stop').catch(e => console.error('Stop error:', e));
+    sendCtl({ op: 'stop' }, '/api/stop', 'Stop');
     joyKnob.style.transform = 'translate(-50%, -50%)';
     zoomSlider.value = 0;
     focusSlider.value = 0;
     updateLabels();
 });
 
+document.getElementById('clear-btn').addEventListener('click', () => {
+    if (confirm('Clear all presets?')) {
+        fetch('/api/preset/delete_all').catch(e => console.error('Preset clear error:', e));
+    }
+});
+
 homeBtn.addEventListener('click', () => {
     fetch('/api/preset/call?num=1').catch(e => console.error('Home error:', e));
 });
@@ -478,11 +1128,11 @@ focusAutoBtn.addEventListener('click', () => {
 zoomSlider.addEventListener('input', (e) => {
     const val = parseInt(e.target.value);
     if (val === 0) {
-        fetch('/api/zoom?dir=stop').catch(e => console.error('Zoom error:', e));
+        sendCtl({ op: 'zoom', dir: 'stop' }, '/api/zoom?dir=stop', 'Zoom');
     } else {
         const dir = val > 0 ? 'in' : 'out';
         const speed = Math.abs(val);
-        fetch(`/api/zoom?dir=${dir}&s=${speed}`).catch(e => console.error('Zoom error:', e));
+        sendCtl({ op: 'zoom', dir, s: speed }, `/api/zoom?dir=${dir}&s=${speed}`, 'Zoom');
     }
     updateLabels();
 });
@@ -490,11 +1140,11 @@ zoomSlider.addEventListener('input', (e) => {
 focusSlider.addEventListener('input', (e) => {
     const val = parseInt(e.target.value);
     if (val === 0) {
-        fetch('/api/focus?dir=stop').catch(e => console.error('Focus error:', e));
+        sendCtl({ op: 'focus', dir: 'stop' }, '/api/focus?dir=stop', 'Focus');
     } else {
         const dir = val > 0 ? 'near' : 'far';
         const speed = Math.abs(val);
-        fetch(`/api/focus?dir=${dir}&s=${speed}`).catch(e => console.error('Focus error:', e));
+        sendCtl({ op: 'focus', dir, s: speed }, `/api/focus?dir=${dir}&s=${speed}`, 'Focus');
     }
     updateLabels();
 });
@@ -509,7 +1159,7 @@ function updateLabels() {
 
 function generatePresets() {
     const container = document.getElementById('presets');
-    for (let i = 1; i <= 16; i++) {
+    for (let i = 1; i <= PRESET_SLOTS; i++) {
         const btn = document.createElement('button');
         btn.className = 'preset-btn';
         btn.textContent = 'P' + i;
@@ -525,36 +1175,123 @@ function generatePresets() {
     }
 }
 
-function updateStatus() {
-    fetch('/api/status')
-        .then(r => r.json())
-        .then(d => {
-            camStatus.textContent = d.reachable ? '🟢' : '🔴';
-            if (d.stream_status === 'live') {
-                streamStatus.textContent = '🟢';
-                videoInfo.textContent = `LIVE ${d.stream_fps} FPS`;
-                videoInfo.style.color = '#4CAF50';
-            } else if (d.stream_status === 'buffering') {
-                streamStatus.textContent = '🟡';
-                videoInfo.textContent = 'BUFFERING';
-            } else {
-                streamStatus.textContent = '🔴';
-                videoInfo.textContent = 'OFFLINE';
+// One shared status stream; every consumer renders from lastState
+let lastState = null;
+let mseActive = false;   // server MJPEG stats don't apply while playing /video.mp4
+
+function applyStatus(d) {
+    camStatus.textContent = d.reachable ? '🟢' : '🔴';
+    if (mseActive) return;
+    if (d.stream_status === 'live') {
+        streamStatus.textContent = '🟢';
+        videoInfo.textContent = `LIVE ${d.stream_fps} FPS`;
+        videoInfo.style.color = '#4CAF50';
+    } else if (d.stream_status === 'buffering') {
+        streamStatus.textContent = '🟡';
+        videoInfo.textContent = 'BUFFERING';
+    } else {
+        streamStatus.textContent = '🔴';
+        videoInfo.textContent = 'OFFLINE';
+    }
+}
+
+const statusEvents = new EventSource('/api/events');
+statusEvents.onmessage = (e) => {
+    lastState = JSON.parse(e.data);
+    applyStatus(lastState);
+};
+statusEvents.onerror = () => console.error('Status stream error, reconnecting');
+
+// Prefer native H.264 via MSE (/video.mp4); keep the MJPEG <img> as fallback
+const PRESET_SLOTS = __PRESET_SLOTS__;
+
+async function startMseVideo() {
+    if (!window.MediaSource) return;
+    let r;
+    try {
+        r = await fetch('/video.mp4');
+        if (!r.ok) throw new Error(`HTTP ${r.status}`);
+    } catch (e) {
+        console.error('MSE video unavailable, using MJPEG:', e);
+        return;
+    }
+    // The server reads the codec (profile/level) from the stream's avcC box
+    const mseType = `video/mp4; codecs="${r.headers.get('X-Video-Codec')}"`;
+    if (!MediaSource.isTypeSupported(mseType)) {
+        console.error(`MSE can't play ${mseType}, using MJPEG`);
+        r.body.cancel();
+        return;
+    }
+    const img = document.querySelector('.video img');
+    const video = document.createElement('video');
+    video.muted = true;
+    video.autoplay = true;
+    video.playsInline = true;
+    video.style.display = 'none';
+    img.after(video);
+    
+    const ms = new MediaSource();
+    video.src = URL.createObjectURL(ms);
+    ms.addEventListener('sourceopen', async () => {
+        const pending = [];
+        let shown = false;
+        try {
+            const sb = ms.addSourceBuffer(mseType);
+            sb.addEventListener('updateend', () => {
+                // The first chunk is only the init segment: swap out the MJPEG <img>
+                // once real media has been buffered
+                if (!shown && sb.buffered.length) {
+                    shown = true;
+                    img.src = '';
+                    img.remove();
+                    video.style.display = '';
+                    mseActive = true;
+                    streamStatus.textContent = '🟢';
+                    videoInfo.textContent = 'LIVE H.264';
+                    videoInfo.style.color = '#4CAF50';
+                }
+                if (pending.length && !sb.updating) sb.appendBuffer(pending.shift());
+                // Stay at the live edge
+                const b = video.buffered;
+                if (b.length && b.end(b.length - 1) - video.currentTime > 1) {
+                    video.currentTime = b.end(b.length - 1) - 0.1;
+                }
+            });
+            const reader = r.body.getReader();
+            for (;;) {
+                const { value, done } = await reader.read();
+                if (done) throw new Error('stream ended');
+                if (sb.updating || pending.length) pending.push(value);
+                else sb.appendBuffer(value);
             }
-        })
-        .catch(e => console.error('Status error:', e));
+        } catch (e) {
+            console.error('MSE video error, using MJPEG:', e);
+            mseActive = false;
+            r.body.cancel().catch(() => {});
+            if (!img.isConnected) {
+                img.src = '/video';
+                video.before(img);
+            }
+            video.remove();
+        }
+    });
 }
 
-generatePr esets();
+generatePresets();
 updateLabels();
-updateStatus();
-setInterval(updateStatus, 2000);
+connectCtl();
+startMseVideo();
 </script>
 </body>
 </html>
 """
 
-if __name__ == '__main__':
+_INDEX_BYTES = HTML.replace('__PRESET_SLOTS__', str(PRESET_SLOTS)).encode('utf-8')
+_INDEX_GZIP = gzip.compress(_INDEX_BYTES, 9)
+_INDEX_ETAG = hashlib.md5(_INDEX_BYTES).hexdigest()
+
+def start_services():
+    """Load config and start the camera health check (once per process)"""
     load_config()
     check_camera()
     
@@ -566,6 +1303,9 @@ if __name__ == '__main__':
     
     t = threading.Thread(target=bg_check, daemon=True)
     t.start()
+
+if __name__ == '__main__':
+    load_config()
     
     logger.info("\n" + "="*60)
     logger.info("PTZ11 CONTROLLER - FRESH START")
@@ -575,4 +1315,8 @@ if __name__ == '__main__':
     logger.info(f"URL: http://127.0.0.1:5007")
     logger.info("="*60 + "\n")
     
+    # Prefer gunicorn + gevent; its worker runs start_services()
+    exec_gunicorn('app')
+    
+    start_services()
     app.run(host='127.0.0.1', port=5007, threaded=True, debug=False)
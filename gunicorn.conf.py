@@ -0,0 +1,20 @@
+"""
+Gunicorn config for the PTZ11 controller
+Usage: gunicorn -c gunicorn.conf.py app:app
+       gunicorn -c gunicorn.conf.py ptz11_controller:app
+
+One gevent worker: each MJPEG viewer is a greenlet instead of an OS thread.
+Capture/frame thread, VISCA sender and camera state live in-process, so keep workers=1.
+"""
+
+import sys
+
+bind = '127.0.0.1:5007'
+worker_class = 'gevent'
+workers = 1
+worker_connections = 1000
+
+def post_worker_init(worker):
+    """Run the app's one-time startup inside the worker"""
+    module = sys.modules[worker.wsgi.import_name]
+    module.start_services()
@@ -8,24 +8,31 @@ VISCA Protocol over UDP with interactive joystick control
 import cv2
 import threading
 import socket
+import select
 import time
 import json
+import queue
+import struct
+import functools
+import ctypes
+import ctypes.util
 import logging
+import hashlib
 import sys
-from flask import Flask, render_template_string, request, Response, jsonify
-from datetime import datetime
-import subprocess
+from flask import Flask, request, Response
 import numpy as np
+import orjson
+from ptz_common import FFMPEG_BIN, FFmpegMJPEG, run_blocking, exec_gunicorn
 
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s',
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.logger.setLevel(logging.DEBUG)
+app.logger.setLevel(logging.INFO)
 
 CONFIG = {
     'camera': {
@@ -35,26 +42,36 @@ CONFIG = {
         'device_id': '3301432581P2107',
         'firmware_version': 'V1.3.81',
     },
-    'protocol': {'sequence': 1, 'timeout': 0.5},
+    'protocol': {'sequence': 1, 'timeout': 0.5, 'ack_wait': 0.08},
     'ptz': {'pan_speed_max': 24, 'tilt_speed_max': 20, 'zoom_speed_max': 7, 'focus_speed_max': 8},
     'video': {'buffer_size': 1, 'jpeg_quality': 60, 'resolution': (640, 360),}
 }
 
 STATUS = {'camera_reachable': False, 'last_command': None, 'last_error': None}
 PRESET_MEMORY = {'presets': {}}
-visca_lock = threading.Lock()
+# Synchronous commands of one subsystem stay ordered (held across the ACK wait); _io_lock
+# only covers the send itself. Pan/tilt, zoom and focus moves go through the send queue.
+_LOCKS = {'focus': threading.Lock(), 'preset': threading.Lock()}
+_io_lock = threading.Lock()
+_seq_lock = threading.Lock()
+
+# VISCA power inquiry (81 09 04 00 FF) with the inquiry payload type 0x0110
+_PROBE_PACKET = b'\x01\x10\x00\x05\x00\x00\x00\x00\x81\x09\x04\x00\xFF'
 
 def check_camera_reachable():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        result = subprocess.run(['ping', '-c', '1', '-W', '1', CONFIG['camera']['ip']], capture_output=True, timeout=3)
-        reachable = result.returncode == 0
-        STATUS['camera_reachable'] = reachable
-        logger.info(f"Camera ping: {chr(10003) + ' REACHABLE' if reachable else chr(10007) + ' UNREACHABLE'}")
-        return reachable
-    except Exception as e:
-        logger.error(f"Ping error: {e}")
-        STATUS['camera_reachable'] = False
-        return False
+        sock.settimeout(0.3)
+        sock.sendto(_PROBE_PACKET, (CONFIG['camera']['ip'], CONFIG['camera']['port']))
+        sock.recvfrom(1024)
+        reachable = True
+    except OSError:
+        reachable = False
+    finally:
+        sock.close()
+    STATUS['camera_reachable'] = reachable
+    logger.info(f"Camera probe: {chr(10003) + ' REACHABLE' if reachable else chr(10007) + ' UNREACHABLE'}")
+    return reachable
 
 def test_udp_connection():
     try:
@@ -76,60 +93,267 @@ def test_udp_connection():
         logger.error(f"UDP test failed: {e}")
         return False
 
+@functools.lru_cache(maxsize=2)
+def _local_second(sec):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sec))
+
+def iso_timestamp():
+    """Local time as datetime.now().isoformat() formats it, from time_ns(); strftime runs once per second"""
+    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+    return f"{_local_second(sec)}.{ns // 1000:06d}"
+
 def increment_sequence():
-    CONFIG['protocol']['sequence'] = (CONFIG['protocol']['sequence'] + 1) & 0xFFFFFFFF
-    return CONFIG['protocol']['sequence']
+    with _seq_lock:
+        CONFIG['protocol']['sequence'] = (CONFIG['protocol']['sequence'] + 1) & 0xFFFFFFFF
+        return CONFIG['protocol']['sequence']
+
+_HEADER = struct.Struct('>BBBBI')
+_TRAILER = b'\xFF'
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+_SCRATCH = threading.local()
+
+@functools.lru_cache(maxsize=512)
+def parse_payload(payload_hex):
+    clean_hex = payload_hex.replace(" ", "").upper()
+    return bytes.fromhex(clean_hex), clean_hex
 
 def build_visca_packet(payload_hex):
     try:
-        payload_hex = payload_hex.replace(" ", "").upper()
-        payload = bytearray.fromhex(payload_hex)
+        payload, clean_hex = parse_payload(payload_hex)
         seq = increment_sequence()
-        msg_length = len(payload) + 1
-        header = bytearray([0x01, 0x00, 0x00, msg_length & 0xFF])
-        header.extend(seq.to_bytes(4, byteorder="big"))
-        packet = header + payload + b'\xFF'
-        return packet, payload_hex
+        total = _HEADER.size + len(payload) + 1
+        buf = getattr(_SCRATCH, 'buf', None)
+        if buf is None or len(buf) < total:
+            buf = _SCRATCH.buf = bytearray(max(64, total))
+        _HEADER.pack_into(buf, 0, 0x01, 0x00, 0x00, (len(payload) + 1) & 0xFF, seq)
+        buf[_HEADER.size:total - 1] = payload
+        buf[total - 1] = 0xFF
+        return bytes(memoryview(buf)[:total]), clean_hex
     except Exception as e:
-        logger.error(f"Packet build error: {e}")
+        logger.error("Packet build error: %s", e)
         return None, str(e)
 
-def send_visca_command(payload_hex):
-    with visca_lock:
+def open_visca_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Room for joystick bursts and queued ACKs; never fragment (VISCA packets are tiny)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    if sys.platform.startswith('linux'):
+        # Not exported by every Python's socket module; values from <linux/in.h>
+        sock.setsockopt(socket.IPPROTO_IP, getattr(socket, 'IP_MTU_DISCOVER', 10), getattr(socket, 'IP_PMTUDISC_DO', 2))
+    try:
+        sock.connect((CONFIG['camera']['ip'], CONFIG['camera']['port']))
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(CONFIG['protocol']['timeout'])
+    return sock
+
+# Written on reconnect so visca_ack_reader stops waiting on the old socket
+_wake_r, _wake_w = socket.socketpair()
+
+def reconnect_visca_socket():
+    global _VISCA_SOCK
+    if _VISCA_SOCK is not None:
         try:
-            packet, clean_hex = build_visca_packet(payload_hex)
-            if packet is None:
-                return False, "Packet build failed"
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(CONFIG['protocol']['timeout'])
-            logger.debug(f"Sending VISCA: {clean_hex}")
-            sock.sendto(packet, (CONFIG['camera']['ip'], CONFIG['camera']['port']))
+            _VISCA_SOCK.close()
+        except OSError:
+            pass
+        _VISCA_SOCK = None
+        logger.warning("VISCA socket reconnecting")
+    _VISCA_SOCK = open_visca_socket()
+    try:
+        _wake_w.send(b'\x00')
+    except OSError:
+        pass
+
+def visca_socket():
+    """The connected VISCA socket, connecting on first use (OSError if the camera has no route)"""
+    if _VISCA_SOCK is None:
+        reconnect_visca_socket()
+    return _VISCA_SOCK
+
+# connect() fails without a route to the camera (boot, off-LAN): don't block startup on it
+_VISCA_SOCK = None
+try:
+    reconnect_visca_socket()
+except OSError as e:
+    logger.warning("VISCA socket not connected yet: %s", e)
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+def load_sendmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fn = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    fn.restype = ctypes.c_int
+    return fn
+
+_sendmmsg = load_sendmmsg()
+_VISCA_BATCH = 100
+_visca_q = queue.Queue()
+# sendmmsg arrays are only touched by visca_sender, so they are built once and reused
+_mm_iovs = (_IOVec * _VISCA_BATCH)()
+_mm_msgs = (_MMsgHdr * _VISCA_BATCH)()
+for _i in range(_VISCA_BATCH):
+    _mm_msgs[_i].msg_hdr.msg_iov = ctypes.pointer(_mm_iovs[_i])
+    _mm_msgs[_i].msg_hdr.msg_iovlen = 1
+# Reply sequence (header bytes 4-8) -> waiter of a synchronous command
+_pending = {}
+
+def send_batch(packets):
+    # Same lock as send_visca_command: one lazy connect, and no close/reconnect mid-send
+    with _io_lock:
+        sock = visca_socket()
+        sent = 0
+        # A lone packet (the usual case) is cheaper as a plain send than building the mmsghdr
+        if _sendmmsg is not None and len(packets) > 1:
+            for i, pkt in enumerate(packets):
+                _mm_iovs[i].iov_base = ctypes.cast(ctypes.c_char_p(pkt), ctypes.c_void_p)
+                _mm_iovs[i].iov_len = len(pkt)
+            sent = max(0, _sendmmsg(sock.fileno(), _mm_msgs, len(packets), 0))
+        for pkt in packets[sent:]:
+            sock.send(pkt)
+
+def visca_sender():
+    while True:
+        packets = [_visca_q.get()]
+        while len(packets) < _VISCA_BATCH:
             try:
-                response, _ = sock.recvfrom(1024)
-                if len(response) >= 8:
-                    msg_type = response[0]
-                    if msg_type in [0x90, 0x91]:
-                        STATUS['last_command'] = clean_hex
-                        sock.close()
-                        return True, "OK"
-            except socket.timeout:
-                STATUS['last_command'] = clean_hex
-                sock.close()
-                return True, "OK"
-        except Exception as e:
+                packets.append(_visca_q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            send_batch(packets)
+        except OSError as e:
+            STATUS['last_error'] = f"Error: {str(e)}"
+            logger.error("VISCA batch send failed: %s", e)
+            try:
+                with _io_lock:
+                    reconnect_visca_socket()
+            except OSError as e2:
+                logger.error("VISCA reconnect failed: %s", e2)
+
+def visca_ack_reader():
+    """Drain every ACK/completion reply; wake a synchronous command waiting on its sequence"""
+    while True:
+        sock = _VISCA_SOCK
+        try:
+            ready = select.select([_wake_r] if sock is None else [sock, _wake_r], [], [], 0.5)[0]
+            if _wake_r in ready:
+                _wake_r.recv(64)
+                continue
+            if not ready:
+                continue
+            data = sock.recv(1024)
+        except (OSError, ValueError):
+            # Socket closed or replaced by reconnect_visca_socket
+            continue
+        if len(data) >= 8:
+            waiter = _pending.pop(data[4:8], None)
+            if waiter is not None:
+                waiter['reply'] = data
+                waiter['evt'].set()
+
+threading.Thread(target=visca_sender, daemon=True).start()
+threading.Thread(target=visca_ack_reader, daemon=True).start()
+
+def send_visca_async(payload_hex):
+    packet, clean_hex = build_visca_packet(payload_hex)
+    if packet is None:
+        return False, "Packet build failed"
+    logger.debug("Queueing VISCA: %s", clean_hex)
+    _visca_q.put(packet)
+    STATUS['last_command'] = clean_hex
+    return True, "OK"
+
+def send_visca_command(payload_hex, subsys='preset'):
+    try:
+        payload, clean_hex = parse_payload(payload_hex)
+    except ValueError as e:
+        logger.error("Packet build error: %s", e)
+        return False, "Packet build failed"
+    with _LOCKS[subsys]:
+        try:
+            header = getattr(_SCRATCH, 'header', None)
+            if header is None:
+                header = _SCRATCH.header = bytearray(_HEADER.size)
+            _HEADER.pack_into(header, 0, 0x01, 0x00, 0x00, (len(payload) + 1) & 0xFF, increment_sequence())
+            seq_bytes = bytes(header[4:8])
+            logger.debug("Sending VISCA: %s", clean_hex)
+            # Register before sending so a fast reply can't be missed
+            waiter = {'evt': threading.Event(), 'reply': None}
+            _pending[seq_bytes] = waiter
+            try:
+                with _io_lock:
+                    # Gather write: the kernel assembles header + payload + FF, no concatenated copy
+                    sock = visca_socket()
+                    if _HAS_SENDMSG:
+                        sock.sendmsg([header, payload, _TRAILER])
+                    else:
+                        sock.send(bytes(header) + payload + _TRAILER)
+                # A missing ACK is treated as OK after a short wait rather than the socket timeout
+                waiter['evt'].wait(CONFIG['protocol']['ack_wait'])
+            finally:
+                _pending.pop(seq_bytes, None)
+            response = waiter['reply']
+            # 90 4y = ACK, 90 5y = completion, 90 6y = error
+            if response is not None and len(response) >= 10 and response[8] & 0xF0 == 0x90 and response[9] & 0xF0 == 0x60:
+                error_msg = f"VISCA error reply: {response[8:].hex(' ')}"
+                STATUS['last_error'] = error_msg
+                return False, error_msg
+            STATUS['last_command'] = clean_hex
+            return True, "OK"
+        except OSError as e:
             error_msg = f"Error: {str(e)}"
             STATUS['last_error'] = error_msg
             logger.error(error_msg)
             try:
-                sock.close()
-            except:
-                pass
+                with _io_lock:
+                    reconnect_visca_socket()
+            except OSError as e2:
+                logger.error("VISCA reconnect failed: %s", e2)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Error: {str(e)}"
+            STATUS['last_error'] = error_msg
+            logger.error(error_msg)
             return False, error_msg
-    return False, "Unknown error"
+
+def pan_tilt_template(speed, pan_dir, tilt_dir):
+    payload, clean_hex = parse_payload(f"81 01 06 01 {speed:02X} {speed:02X} {pan_dir} {tilt_dir}")
+    return _HEADER.pack(0x01, 0x00, 0x00, len(payload) + 1, 0) + payload + b'\xFF', clean_hex
+
+# Joystick moves only ever use these directions with equal pan/tilt speeds; only the sequence changes per send.
+_PT_DIRS = ('01', '02', '03')
+_PT_TABLE = {(p, t, s): pan_tilt_template(s, p, t) for p in _PT_DIRS for t in _PT_DIRS for s in range(25)}
 
 def visca_pan_tilt(pan_speed, tilt_speed, pan_dir, tilt_dir):
-    cmd = f"81 01 06 01 {pan_speed:02X} {tilt_speed:02X} {pan_dir} {tilt_dir}"
-    return send_visca_command(cmd)
+    entry = _PT_TABLE.get((pan_dir, tilt_dir, pan_speed)) if pan_speed == tilt_speed else None
+    if entry is None:
+        cmd = f"81 01 06 01 {pan_speed:02X} {tilt_speed:02X} {pan_dir} {tilt_dir}"
+        return send_visca_async(cmd)
+    template, clean_hex = entry
+    buf = bytearray(template)
+    struct.pack_into('>I', buf, 4, increment_sequence())
+    _visca_q.put(bytes(buf))
+    STATUS['last_command'] = clean_hex
+    return True, "OK"
 
 def visca_zoom(zoom_dir, zoom_speed):
     if zoom_dir == 'in':
@@ -139,7 +363,7 @@ def visca_zoom(zoom_dir, zoom_speed):
     else:
         byte = 0x00
     cmd = f"81 01 04 07 {byte:02X}"
-    return send_visca_command(cmd)
+    return send_visca_async(cmd)
 
 def visca_focus(focus_dir, focus_speed):
     if focus_dir == 'near':
@@ -149,71 +373,256 @@ def visca_focus(focus_dir, focus_speed):
     else:
         byte = 0x00
     cmd = f"81 01 04 08 {byte:02X}"
-    return send_visca_command(cmd)
+    return send_visca_async(cmd)
 
 def visca_auto_focus():
-    return send_visca_command("81 01 04 38 02")
+    return send_visca_command("81 01 04 38 02", 'focus')
 
 def visca_preset_recall(preset_num):
     if not (0 <= preset_num <= 254):
         return False, "Invalid preset"
     cmd = f"81 01 04 3F 02 {preset_num:02X}"
-    return send_visca_command(cmd)
+    return send_visca_command(cmd, 'preset')
 
 def visca_preset_save(preset_num):
     if not (0 <= preset_num <= 254):
         return False, "Invalid preset"
     cmd = f"81 01 04 3F 01 {preset_num:02X}"
-    PRESET_MEMORY['presets'][preset_num] = {'timestamp': datetime.now().isoformat()}
-    return send_visca_command(cmd)
+    PRESET_MEMORY['presets'][preset_num] = {'timestamp': iso_timestamp()}
+    return send_visca_command(cmd, 'preset')
 
-def gen_frames():
-    logger.info("Starting video stream...")
+# frame_loop owns the capture and encode_loop the encoder; request
+# threads only take a reference to the immutable _latest_part bytes and write it out.
+_frame_cond = threading.Condition()
+_latest_part = None   # header + jpeg + trailer, framed once for all viewers
+_frame_thread = None
+viewers = 0
+# Decode -> encode hand-off; holds only the newest frame, older ones are dropped
+_decoded_q = queue.Queue(maxsize=1)
+_MJPEG_HDR = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+_MJPEG_TRL = b'\r\n'
+
+def has_cuda():
+    try:
+        return hasattr(cv2, 'cudacodec') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+CUDA_AVAILABLE = has_cuda()
+_gpu = {}
+
+def init_gpu_buffers():
+    # Pool usage must be configured before the stream that draws from it is created.
+    cv2.cuda.setBufferPoolUsage(True)
+    cv2.cuda.setBufferPoolConfig(cv2.cuda.getDevice(), 64 * 1024 * 1024, 2)
+    stream = cv2.cuda_Stream()
+    pool = cv2.cuda.BufferPool(stream)
+    w, h = CONFIG['video']['resolution']
+    _gpu['stream'] = stream
+    _gpu['decoded'] = cv2.cuda_GpuMat()
+    _gpu['resized'] = pool.getBuffer(h, w, cv2.CV_8UC4)
+    _gpu['bgr'] = pool.getBuffer(h, w, cv2.CV_8UC3)
+
+if CUDA_AVAILABLE:
+    try:
+        init_gpu_buffers()
+    except cv2.error as e:
+        logger.warning(f"CUDA buffer pool unavailable: {e}")
+        CUDA_AVAILABLE = False
+
+try:
+    from nvjpeg import NvJpeg
+    _nvjpeg = NvJpeg() if CUDA_AVAILABLE else None
+except Exception:
+    _nvjpeg = None
+
+def open_stream():
+    """Open RTSP; returns (cap, mode) with mode 'jpeg' (ffmpeg pipe), 'gpu' (NVDEC) or 'cpu'"""
+    if FFMPEG_BIN:
+        logger.info(f"Opening RTSP via ffmpeg MJPEG pipe: {CONFIG['camera']['rtsp']}")
+        # No MJPEG NVENC encoder exists; -hwaccel auto picks CUDA/VAAPI/QSV decode when present
+        return FFmpegMJPEG(CONFIG['camera']['rtsp'], CONFIG['video']['resolution'], quality=6, hwaccel='auto'), 'jpeg'
+    if CUDA_AVAILABLE:
+        try:
+            logger.info(f"Opening RTSP with NVDEC: {CONFIG['camera']['rtsp']}")
+            return run_blocking(cv2.cudacodec.createVideoReader, CONFIG['camera']['rtsp']), 'gpu'
+        except cv2.error as e:
+            logger.warning(f"NVDEC open failed, using CPU decode: {e}")
+    logger.info(f"Opening RTSP: {CONFIG['camera']['rtsp']}")
+    cap = run_blocking(cv2.VideoCapture, CONFIG['camera']['rtsp'])
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, CONFIG['video']['buffer_size'])
+    return cap, 'cpu'
+
+def read_frame(cap, mode):
+    if mode == 'gpu':
+        stream = _gpu['stream']
+        success, decoded = cap.nextFrame(_gpu['decoded'], stream)
+        if not success:
+            return False, None
+        cv2.cuda.resize(decoded, CONFIG['video']['resolution'], _gpu['resized'], stream=stream)
+        cv2.cuda.cvtColor(_gpu['resized'], cv2.COLOR_BGRA2BGR, _gpu['bgr'], stream=stream)
+        frame = _gpu['bgr'].download(stream)
+        stream.waitForCompletion()
+        return True, frame
+    return cap.read()
+
+def jpeg_params():
+    params = [cv2.IMWRITE_JPEG_QUALITY, CONFIG['video']['jpeg_quality'],
+              cv2.IMWRITE_JPEG_OPTIMIZE, 0, cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+    # Explicit 4:2:0 chroma subsampling needs OpenCV >= 4.5.5
+    if hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'):
+        params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420]
+    return params
+
+_JPEG_PARAMS = jpeg_params()
+
+def encode_frame(frame):
+    w, h = CONFIG['video']['resolution']
+    if frame.shape[1] != w or frame.shape[0] != h:
+        frame = cv2.resize(frame, (w, h))
+    if _nvjpeg is not None:
+        return _nvjpeg.encode(frame, CONFIG['video']['jpeg_quality'])
+    ret, buffer = cv2.imencode('.jpg', frame, _JPEG_PARAMS)
+    return buffer.tobytes() if ret else None
+
+def publish_jpeg(frame_bytes):
+    global _latest_part
+    part = _MJPEG_HDR + frame_bytes + _MJPEG_TRL
+    with _frame_cond:
+        _latest_part = part
+        _frame_cond.notify_all()
+
+def put_latest(q, item):
+    """Non-blocking put that replaces a frame the encoder has not picked up yet"""
+    try:
+        q.put_nowait(item)
+    except queue.Full:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(item)
+
+def frame_loop():
+    logger.info("Starting video decoder...")
     cap = None
+    mode = None
     
     while True:
         try:
+            if not viewers:
+                if cap is not None:
+                    logger.info("No viewers, closing RTSP")
+                    if mode != 'gpu':
+                        cap.release()
+                    cap = None
+                time.sleep(0.1)
+                continue
+            
             if cap is None:
-                logger.info(f"Opening RTSP: {CONFIG['camera']['rtsp']}")
-                cap = cv2.VideoCapture(CONFIG['camera']['rtsp'])
-                cap.set(cv2.CAP_PROP_BUFFERSIZE, CONFIG['video']['buffer_size'])
+                # Not via run_blocking: the ffmpeg pipe must belong to this thread's hub
+                cap, mode = open_stream()
             
-            success, frame = cap.read()
+            if mode == 'jpeg':
+                success, frame_bytes = cap.read()
+                if success:
+                    publish_jpeg(frame_bytes)
+            else:
+                success, frame = run_blocking(read_frame, cap, mode)
+                if success:
+                    put_latest(_decoded_q, frame)
             if not success:
-                logger.warning(f"Frame read failed")
+                logger.warning("Frame read failed")
                 frame = np.zeros((360, 640, 3), dtype=np.uint8)
                 cv2.putText(frame, "Stream Unavailable", (80, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            
-            frame = cv2.resize(frame, CONFIG['video']['resolution'])
-            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CONFIG['video']['jpeg_quality']])
-            
-            if ret:
-                frame_bytes = buffer.tobytes()
-                yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                put_latest(_decoded_q, frame)
+                # Back off and reopen rather than spin on a dead stream
+                if mode != 'gpu':
+                    cap.release()
+                cap = None
+                time.sleep(1)
                    
         except Exception as e:
-            logger.error(f"Stream error: {e}")
+            logger.error("Stream error: %s", e)
             time.sleep(1)
 
+def encode_loop():
+    logger.info("Starting video encoder...")
+    while True:
+        frame = _decoded_q.get()
+        try:
+            frame_bytes = run_blocking(encode_frame, frame)
+            if frame_bytes:
+                publish_jpeg(frame_bytes)
+        except Exception as e:
+            logger.error("Encode error: %s", e)
+
+def start_frame_thread():
+    global _frame_thread
+    with _frame_cond:
+        if _frame_thread is None:
+            _frame_thread = threading.Thread(target=frame_loop, daemon=True)
+            _frame_thread.start()
+            threading.Thread(target=encode_loop, daemon=True).start()
+
+def gen_frames():
+    """Generate video frames for one viewer; the frame thread only reads RTSP while viewers > 0"""
+    global viewers
+    start_frame_thread()
+    with _frame_cond:
+        viewers += 1
+    try:
+        while True:
+            with _frame_cond:
+                if not _frame_cond.wait(timeout=5):
+                    continue
+                part = _latest_part
+            # One yield per frame: servers write (and chunk) each yielded item separately
+            yield part
+    finally:
+        with _frame_cond:
+            viewers -= 1
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # The page has no Jinja expressions: serve pre-encoded bytes, 304 on matching If-None-Match
+    resp = Response(_HTML_BYTES, mimetype='text/html')
+    resp.set_etag(_HTML_ETAG)
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    return resp.make_conditional(request)
 
 @app.route('/video_feed')
 def video_feed():
     return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+_LAST_SENT = {}
+_dedupe_lock = threading.Lock()
+DEDUPE_WINDOW = 0.04
+
+def is_repeat(kind, key):
+    now = time.monotonic()
+    with _dedupe_lock:
+        last = _LAST_SENT.get(kind)
+        if last is not None and last[0] == key and now - last[1] < DEDUPE_WINDOW:
+            return True
+        _LAST_SENT[kind] = (key, now)
+        return False
+
 @app.route('/move')
 def move():
     p = request.args.get('p', '03')
     t = request.args.get('t', '03')
     s = int(request.args.get('s', '10'))
     s = max(1, min(24, s))
+    if is_repeat('move', (p, t, s)):
+        return "OK"
     status, msg = visca_pan_tilt(s, s, p, t)
     return msg
 
 @app.route('/stop')
 def stop():
+    with _dedupe_lock:
+        _LAST_SENT.clear()
     visca_pan_tilt(0, 0, '03', '03')
     visca_zoom('stop', 0)
     visca_focus('stop', 0)
@@ -224,6 +633,8 @@ def zoom_move():
     direction = request.args.get('dir', 'stop')
     speed = int(request.args.get('spd', '1'))
     speed = max(1, min(7, speed))
+    if is_repeat('zoom', (direction, speed)):
+        return "OK"
     status, msg = visca_zoom(direction, speed)
     return msg
 
@@ -232,13 +643,15 @@ def focus_move():
     direction = request.args.get('dir', 'stop')
     speed = int(request.args.get('spd', '1'))
     speed = max(1, min(8, speed))
+    if is_repeat('focus', (direction, speed)):
+        return "OK"
     status, msg = visca_focus(direction, speed)
     return msg
 
 @app.route('/focus/auto')
 def focus_auto():
     enable = request.args.get('enable', 'true').lower() == 'true'
-    status, msg = visca_auto_focus() if enable else send_visca_command("81 01 04 38 03")
+    status, msg = visca_auto_focus() if enable else send_visca_command("81 01 04 38 03", 'focus')
     return msg
 
 @app.route('/preset/call/<int:preset>')
@@ -251,23 +664,40 @@ def preset_save(preset):
     status, msg = visca_preset_save(preset - 1)
     return msg
 
+def json_response(payload, cache_control):
+    resp = Response(orjson.dumps(payload), mimetype='application/json')
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
 @app.route('/status')
 def status():
-    return jsonify({
+    # Short max-age absorbs bursts of polls; no ETag, since a revalidated 304
+    # would keep showing the first response's timestamp
+    return json_response({
         'device_id': CONFIG['camera']['device_id'],
         'firmware': CONFIG['camera']['firmware_version'],
         'ip': CONFIG['camera']['ip'],
         'camera_reachable': STATUS['camera_reachable'],
-        'timestamp': datetime.now().isoformat(),
-    })
+        'timestamp': iso_timestamp(),
+    }, 'max-age=1')
 
 @app.route('/test')
 def test():
+    # Live probes on every click: never served from cache
     check_camera_reachable()
     udp_ok = test_udp_connection()
-    return jsonify({'ping': STATUS['camera_reachable'], 'udp': udp_ok, 'camera_ip': CONFIG['camera']['ip'], 'camera_port': CONFIG['camera']['port']})
+    result = {'ping': STATUS['camera_reachable'], 'udp': udp_ok, 'camera_ip': CONFIG['camera']['ip'], 'camera_port': CONFIG['camera']['port']}
+    return json_response(result, 'no-store')
 
 HTML_TEMPLATE = """<!DOCTYPE html><html><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>PTZ11 Controller v6.1</title><link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/nipplejs/0.10.1/nipplejs.min.css"><script src="https://cdnjs.cloudflare.com/ajax/libs/nipplejs/0.10.1/nipplejs.min.js"></script><style>:root{--bg:#0d1117;--panel:#161b22;--border:#30363d;--accent:#58a6ff;--text:#c9d1d9;--success:#238636}*{box-sizing:border-box}body{background:var(--bg);color:var(--text);font-family:monospace;margin:0;padding:20px}.header{background:var(--panel);border-bottom:1px solid var(--border);padding:15px;border-radius:8px;margin-bottom:20px;display:flex;justify-content:space-between;align-items:center}.header h1{margin:0;color:var(--accent)}.header-info{font-size:11px;color:#888}.status-indicator{width:12px;height:12px;border-radius:50%;display:inline-block;margin-left:10px}.status-indicator.ok{background:var(--success)}.status-indicator.error{background:#da3633}.tabs{display:flex;background:var(--panel);border-bottom:1px solid var(--border);margin-bottom:20px}.tab-btn{flex:1;padding:12px;background:transparent;color:var(--text);border:none;font-family:monospace;font-weight:bold;cursor:pointer;border-bottom:3px solid transparent;transition:all 0.2s}.tab-btn.active{border-bottom-color:var(--accent);color:white;background:rgba(88,166,255,0.1)}.page{display:none}.page.active{display:block}.video-box{background:black;border:1px solid var(--border);border-radius:8px;overflow:hidden;text-align:center;margin-bottom:20px;position:relative;min-height:360px}.video-feed{width:100%;max-width:640px;max-height:360px}.video-label{position:absolute;top:10px;left:10px;background:rgba(0,0,0,0.7);padding:5px 10px;color:var(--accent);font-size:11px;border-radius:4px}.console{display:grid;grid-template-columns:80px 1fr 80px;gap:10px;margin-bottom:20px}.slider-col{background:var(--panel);border:1px solid var(--border);border-radius:8px;display:flex;flex-direction:column;align-items:center;justify-content:center;padding:10px;min-height:200px;font-weight:bold}input[type=range]{width:8px;height:150px;margin:10px 0}#joy{position:relative;background:radial-gradient(circle,#222,transparent);border-radius:50%;border:2px dashed var(--border);min-height:200px}.preset-bar{display:flex;gap:5px;margin-bottom:20px;flex-wrap:wrap}.p-btn{flex:1;min-width:60px;background:var(--panel);border:1px solid var(--border);color:white;padding:10px;border-radius:4px;cursor:pointer;transition:all 0.2s;font-weight:bold}.p-btn:hover{border-color:var(--accent);box-shadow:0 0 8px rgba(88,166,255,0.3)}.btn{background:var(--panel);border:1px solid var(--border);color:var(--text);padding:8px 12px;margin:5px;border-radius:4px;cursor:pointer;font-weight:bold}.btn:hover{border-color:var(--accent)}.btn-primary{background:var(--accent);color:black}.log-window{background:#000;border:1px solid var(--border);border-radius:4px;padding:10px;font-size:11px;color:#0f0;height:200px;overflow-y:auto;margin-bottom:10px;font-family:monospace}.cmd-input{display:flex;gap:10px;margin-bottom:10px}input[type="text"]{flex:1;background:var(--panel);border:1px solid var(--border);color:white;padding:8px;border-radius:4px;font-family:monospace}</style></head><body><div class="header"><div><h1>🎥 PTZ11 Enhanced Controller v6.1</h1><div class="header-info">Device: 192.168.1.11 | Firmware: V1.3.81</div></div><span class="status-indicator" id="statusInd" style="background:#666;"></span></div><div class="tabs"><button class="tab-btn active" onclick="showPage('control')">🎮 CONTROLLER</button><button class="tab-btn" onclick="showPage('terminal')">💻 HEX TERMINAL</button><button class="tab-btn" onclick="showPage('debug')">🔧 DEBUG</button></div><div id="control" class="page active"><div class="video-box"><div class="video-label">LIVE RTSP</div><img src="/video_feed" class="video-feed" onerror="this.style.display='none'" style="height:100%;object-fit:contain;"></div><div class="console"><div class="slider-col"><label>FOCUS</label><input type="range" min="-8" max="8" value="0" id="focusRocker" oninput="handleRocker('focus', this.value)" onchange="resetRocker(this)"><button onclick="fetch('/focus/auto?enable=true')" class="btn" style="width:100%;padding:4px;margin-top:8px;font-size:10px;">AUTO</button></div><div id="joy"></div><div class="slider-col"><label>ZOOM</label><input type="range" min="-7" max="7" value="0" id="zoomRocker" oninput="handleRocker('zoom', this.value)" onchange="resetRocker(this)"></div></div><div class="preset-bar"><button class="p-btn" onclick="handlePreset(1)">P1</button><button class="p-btn" onclick="handlePreset(2)">P2</button><button class="p-btn" onclick="handlePreset(3)">P3</button><button class="p-btn" onclick="handlePreset(4)">P4</button><button class="p-btn" onclick="handlePreset(5)">P5</button></div></div><div id="terminal" class="page"><h2>VISCA HEX Terminal</h2><div class="log-window" id="logs">> PTZ11 v6.1 - DEBUG MODE<br>> Ready for commands<br></div><div class="cmd-input"><input type="text" id="hexInput" placeholder="81 01 04 00 02" autocomplete="off"><button class="btn btn-primary" onclick="sendHex()">SEND</button></div></div><div id="debug" class="page"><h2>System Diagnostics</h2><button class="btn btn-primary" onclick="runDiagnostics()">Run Network Test</button><div id="debugOutput" style="margin-top:15px;"></div></div><script>let manager=nipplejs.create({zone:document.getElementById('joy'),mode:'static',position:{left:'50%',top:'50%'},color:'#58a6ff',size:140});let lastJoyUrl="";manager.on('move',(evt,data)=>{if(!data.angle)return;let force=Math.min(data.distance/70,1);let speed=Math.floor(force*20)+4;speed=Math.min(24,speed);let angle=data.angle.degree;let panDir="03",tiltDir="03";if(angle>70&&angle<110)tiltDir="01";else if(angle>250&&angle<290)tiltDir="02";else if(angle<20||angle>340)panDir="02";else if(angle>160&&angle<200)panDir="01";else if(angle>=20&&angle<=70){panDir="02";tiltDir="01";}else if(angle>=110&&angle<=160){panDir="01";tiltDir="01";}else if(angle>=200&&angle<=250){panDir="01";tiltDir="02";}else if(angle>=290&&angle<=340){panDir="02";tiltDir="02";}let url=`/move?p=${panDir}&t=${tiltDir}&s=${speed}`;if(url!==lastJoyUrl){fetch(url).catch(e=>console.error('Move error:',e));lastJoyUrl=url;}});manager.on('end',()=>{fetch('/stop').catch(e=>console.error('Stop error:',e));lastJoyUrl="";});function showPage(id){document.querySelectorAll('.page').forEach(el=>el.classList.remove('active'));document.querySelectorAll('.tab-btn').forEach(el=>el.classList.remove('active'));document.getElementById(id).classList.add('active');event.target.classList.add('active');}function handleRocker(type,val){let v=parseInt(val);if(v===0)return;let dir=(v>0)?'in':'out';let spd=Math.abs(v);if(type==='zoom'){fetch(`/zoom/move?dir=${dir}&spd=${spd}`).catch(e=>console.error('Zoom error:',e));}else if(type==='focus'){dir=(v>0)?'near':'far';fetch(`/focus/move?dir=${dir}&spd=${spd}`).catch(e=>console.error('Focus error:',e));}}function resetRocker(el){el.value=0;if(el.id.includes('zoom'))fetch('/zoom/move?dir=stop').catch(()=>{});if(el.id.includes('focus'))fetch('/focus/move?dir=stop').catch(()=>{});}function handlePreset(n){fetch(`/preset/call/${n}`).catch(e=>console.error('Preset error:',e));}function sendHex(){let val=document.getElementById('hexInput').value;if(!val)return;let log=document.getElementById('logs');log.innerHTML+=`> ${val}<br>`;log.scrollTop=log.scrollHeight;document.getElementById('hexInput').value='';}function runDiagnostics(){let out=document.getElementById('debugOutput');out.innerHTML='<p>Running diagnostics...</p>';fetch('/test').then(r=>r.json()).then(data=>{out.innerHTML=`<p>Camera IP: ${data.camera_ip}</p><p>Ping: ${data.ping?'✓ REACHABLE':'✗ UNREACHABLE'}</p><p>UDP: ${data.udp?'✓ RESPONDING':'⚠ No response'}</p>`;}).catch(e=>{out.innerHTML=`<p>Error: ${e}</p>`;});}function updateStatusIndicator(){fetch('/status').then(r=>r.json()).then(data=>{let ind=document.getElementById('statusInd');ind.className='status-indicator '+(data.camera_reachable?'ok':'error');});}document.getElementById('hexInput')?.addEventListener('keypress',(e)=>{if(e.key==='Enter')sendHex();});setInterval(updateStatusIndicator,5000);updateStatusIndicator();</script></body></html>"""
+_HTML_BYTES = HTML_TEMPLATE.encode('utf-8')
+_HTML_ETAG = hashlib.md5(_HTML_BYTES).hexdigest()
+
+def start_services():
+    """One-time startup: camera checks and the shared frame thread"""
+    check_camera_reachable()
+    test_udp_connection()
+    start_frame_thread()
 
 if __name__ == '__main__':
     print("""
@@ -283,6 +713,7 @@ if __name__ == '__main__':
     ╠═══════════════════════════════════════════════════════════════╣
     """)
     logger.info("Starting PTZ11 Controller v6.1...")
-    check_camera_reachable()
-    test_udp_connection()
+    # Prefer gunicorn + gevent; its worker runs start_services()
+    exec_gunicorn('ptz11_controller')
+    start_services()
     app.run(host='127.0.0.1', port=5007, threaded=True, debug=False, use_reloader=False)
@@ -0,0 +1,79 @@
+"""
+Shared helpers for app.py and ptz11_controller.py
+gevent-aware blocking calls, the ffmpeg MJPEG reader and the gunicorn launcher
+"""
+
+import logging, os, sys, shutil, subprocess
+
+try:
+    import gevent
+    from gevent import monkey as gevent_monkey
+except ImportError:
+    gevent = None
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BIN = shutil.which('ffmpeg')
+
+def gevent_patched():
+    """True when running under gevent with threading monkey-patched (gunicorn gevent worker)"""
+    return gevent is not None and gevent_monkey.is_module_patched('threading')
+
+def run_blocking(fn, *args):
+    """Run a blocking OpenCV call off the gevent hub when monkey-patched"""
+    if gevent_patched():
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+class FFmpegMJPEG:
+    """ffmpeg subprocess transcoding RTSP to MJPEG on stdout, read like cv2.VideoCapture"""
+
+    def __init__(self, url, size, quality=5, hwaccel=None):
+        w, h = size
+        hw = ['-hwaccel', hwaccel] if hwaccel else []
+        self.proc = subprocess.Popen(
+            [FFMPEG_BIN, '-nostdin', '-loglevel', 'error'] + hw +
+            ['-fflags', 'nobuffer', '-flags', 'low_delay', '-rtsp_transport', 'tcp',
+             '-i', url, '-an', '-vf', f'scale={w}:{h}', '-c:v', 'mjpeg', '-q:v', str(quality),
+             '-f', 'mjpeg', 'pipe:1'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+        )
+        self.buf = bytearray()
+        self.scan = 0
+
+    def isOpened(self):
+        return self.proc.poll() is None
+
+    def read(self):
+        """Return (True, jpeg_bytes) for the next complete SOI..EOI frame, (False, None) on EOF"""
+        while True:
+            end = self.buf.find(b'\xff\xd9', self.scan)
+            if end >= 0:
+                start = self.buf.find(b'\xff\xd8', 0, end)
+                jpg = bytes(self.buf[start:end + 2]) if start >= 0 else None
+                del self.buf[:end + 2]
+                self.scan = 0
+                if jpg:
+                    return True, jpg
+                continue
+            self.scan = max(0, len(self.buf) - 1)
+            chunk = self.proc.stdout.read(65536)
+            if not chunk:
+                return False, None
+            self.buf += chunk
+
+    def release(self):
+        self.proc.kill()
+        self.proc.wait()
+
+def exec_gunicorn(module):
+    """Replace this process with gunicorn + gevent serving module:app (see gunicorn.conf.py);
+    its worker runs the module's start_services(). Returns only if gunicorn is not installed."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        logger.warning("gunicorn not installed, using the Flask dev server")
+        return
+    os.execv(sys.executable, [sys.executable, '-m', 'gunicorn', '--chdir', here,
+                              '-c', os.path.join(here, 'gunicorn.conf.py'), f'{module}:app'])